@@ -1,11 +1,21 @@
-from flask import Flask, request, jsonify
+import threading
+from functools import lru_cache
+import orjson
+from cachetools import TTLCache, cached
+from flask import Flask, Response, request
 from flask_cors import CORS
 from ir_core import smart_hybrid_search, autocomplete_titles, lexical_search, fetch_analytics_data
 
+ANALYTICS_TTL = 60  # seconds; also bounds staleness in workers /cache/clear didn't reach
+
 app = Flask(__name__)
 
 CORS(app, origins=["*"])  # Allow all origins (fine for local dev)
 
+def ojson(data):
+    # orjson encodes straight to bytes, several times faster than jsonify on large hit lists
+    return Response(orjson.dumps(data, option=orjson.OPT_SERIALIZE_NUMPY), mimetype="application/json")
+
 @app.route("/search", methods=["GET"])
 def search():
     q = request.args.get("q", "").strip()
@@ -15,7 +25,7 @@ def search():
     size = request.args.get("size", 10, type=int)
 
     if not q:
-        return jsonify([])
+        return ojson([])
 
     # Pass as tuple: (text, start_date, end_date, georeference)
     results=smart_hybrid_search((q, start, end, geo), size=size)
@@ -29,7 +39,7 @@ def search():
         formatted.append({
             "id": hit["_id"],
             "title": source.get("title", "Untitled"),
-            "content": source.get("content", "")[:] + "" if source.get("content") else "",
+            "content": source.get("content") or "",  # Full body: the detail view renders all of it
             "date": source.get("date"),
             "authors": source.get("authors", []),
             "locations": source.get("georeference_names", []),
@@ -39,27 +49,59 @@ def search():
             "temporal_expressions": source.get("temporal_expressions", []),
         })
 
-    return jsonify(formatted)
+    return ojson(formatted)
+
+# -------------------------
+# In-process caches
+# -------------------------
+@lru_cache(maxsize=65536)
+def autocomplete_cached(q):
+    return autocomplete_titles(q)
+
+# Both analytics routes share one aggregation, refreshed at most every ANALYTICS_TTL seconds
+analytics_cache = TTLCache(maxsize=4, ttl=ANALYTICS_TTL)
+
+@cached(cache=analytics_cache, lock=threading.Lock())
+def analytics_cached(top_n=10):
+    return fetch_analytics_data(top_n)
+
+def warm_analytics():
+    # Run the aggregation in the background so the first dashboard load is a cache hit
+    def run():
+        try:
+            analytics_cached(10)
+        except Exception as e:
+            print(f"Analytics pre-warm failed: {e}")
+    threading.Thread(target=run, daemon=True).start()
+
 
 @app.route("/autocomplete", methods=["GET"])
 def autocomplete():
     q = request.args.get("q", "").strip()
     if len(q) < 3:
-        return jsonify([])
-    return jsonify(autocomplete_titles(q))
+        return ojson([])
+    return ojson(autocomplete_cached(q))
 
 
 @app.route("/analytics/top_locations")
 def top_locations():
-    geo_data, _ = fetch_analytics_data(10)
-    return jsonify(geo_data)  # Already list of dicts: [{"location": ..., "count": ...}]
+    geo_data, _ = analytics_cached(10)
+    return ojson(geo_data)  # Already list of dicts: [{"location": ..., "count": ...}]
 
 @app.route("/analytics/timeline")
 def timeline():
-    _, daily_data = fetch_analytics_data(10)
-    return jsonify(daily_data)  # Already dict: {"1987-03-01": 45, ...}
+    _, daily_data = analytics_cached(10)
+    return ojson(daily_data)  # Already dict: {"1987-03-01": 45, ...}
 
+@app.route("/cache/clear", methods=["POST"])
+def clear_cache():
+    # Call after re-indexing so autocomplete/analytics don't serve stale results
+    autocomplete_cached.cache_clear()
+    analytics_cache.clear()
+    warm_analytics()
+    return ojson({"cleared": True})
 
 if __name__ == "__main__":
+    warm_analytics()  # Under gunicorn, gunicorn_conf.post_worker_init does this per worker
     print(" Smart IR API running on http://127.0.0.1:5000")
     app.run(debug=True)
\ No newline at end of file
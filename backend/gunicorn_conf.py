@@ -0,0 +1,16 @@
+# Production server for app.py:  gunicorn -c gunicorn_conf.py app:app
+# gevent workers monkey-patch socket I/O, so a request waiting on OpenSearch
+# yields to other requests instead of blocking the whole worker.
+
+bind = "127.0.0.1:5000"
+worker_class = "gevent"
+workers = 2
+worker_connections = 1000
+timeout = 60
+
+
+def post_worker_init(worker):
+    # Each worker has its own analytics cache: fill it once the worker is up,
+    # rather than on import of app.py (which scripts and tools do too)
+    from app import warm_analytics
+    warm_analytics()
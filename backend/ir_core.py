@@ -1,81 +1,268 @@
 from datetime import datetime
 from math import exp
-from datetime import timedelta
+from functools import lru_cache
+import numpy as np
+import orjson
 from opensearchpy import OpenSearch
-from sentence_transformers import SentenceTransformer
-from geopy.distance import geodesic
-from indexer import  geocode_cached
+from opensearchpy.exceptions import RequestError
+try:
+    from gevent import monkey, spawn, sleep as gevent_sleep
+    from gevent.event import AsyncResult
+    from gevent.queue import Queue, Empty
+except ImportError:
+    monkey = None
+from indexer import geocode_cached, embed, embed_batch, token_hash, token_bits, ORJSONSerializer, PLACES_TO_LATLON, GAZETTEER
 INDEX_NAME = "reuters_ir_knn"
+SEARCH_BATCH_WINDOW = 0.005  # seconds a batch waits for concurrent requests to join
+SEARCH_BATCH_MAX = 32  # requests per batch
 
 client = OpenSearch(
     hosts=[{"host": "localhost", "port": 9200}],
-    http_compress=True,
+    http_compress=False,  # Loopback: gzip would only cost CPU on both ends
     use_ssl=False,
-    verify_certs=False
+    verify_certs=False,
+    pool_maxsize=64,  # One keep-alive connection per concurrent request (gevent greenlets included)
+    timeout=30,
+    serializer=ORJSONSerializer()
 )
 
-model = SentenceTransformer("all-MiniLM-L6-v2")
+# Candidates carry only the fields the re-rank reads; what the /search response
+# shows (DISPLAY_FIELDS) is fetched afterwards for the final hits alone. Neither
+# includes the 384-float embedding, the title_suggest suffix lists or original_sgml_places
+SOURCE_FILTER = {"includes": ["date", "geopoint", "title_bits", "title_tokens", "content_token_hashes"]}
+DISPLAY_FIELDS = ["title", "content", "authors", "georeference_names", "temporal_expressions"]
+
+# Request bodies are filled into precompiled JSON templates: no nested dicts to
+# build and re-serialize per query. Strings go through client.search/msearch as-is
+_SOURCE_JSON = orjson.dumps(SOURCE_FILTER).decode()
+_LEX_TEMPLATE = (
+    '{"size":%d,"_source":%s,"query":{"bool":{"must":[{"multi_match":'
+    '{"query":%s,"fields":["title^5","content"],"fuzziness":"AUTO"}}],"filter":%s}}}'
+)
+_MSEARCH_HEADER = orjson.dumps({"index": INDEX_NAME}).decode()
+_SEM_TEMPLATE = '{"size":%d,"_source":%s,"query":{"knn":{"content_vector":{"vector":%s,"k":%d}}}}'
+# Same, with a filter applied during the HNSW search (k hits that all match it)
+_SEM_FILTERED_TEMPLATE = (
+    '{"size":%d,"_source":%s,"query":{"knn":{"content_vector":{"vector":%s,"k":%d,"filter":%s}}}}'
+)
 
 # -------------------------
 # Lexical Search
 # -------------------------
-def lexical_search(query, start_date=None, end_date=None, size=10):
-    filters = []
+def _lexical_body(query, start_date=None, end_date=None, size=10):
+    r = {}
+    if start_date:
+        r["gte"] = start_date
+    if end_date:
+        r["lte"] = end_date
+    filters = [{"range": {"date": r}}] if r else []
 
-    if start_date or end_date:
-        r = {}
-        if start_date:
-            r["gte"] = start_date
-        if end_date:
-            r["lte"] = end_date
-        filters.append({"range": {"date": r}})
+    return _LEX_TEMPLATE % (size, _SOURCE_JSON, orjson.dumps(query).decode(), orjson.dumps(filters).decode())
 
-    body = {
-        "size": size,
-        "query": {
-            "bool": {
-                "must": [{
-                    "multi_match": {
-                        "query": query,
-                        "fields": ["title^5", "content"],
-                        "fuzziness": "AUTO" ,
-                       
-                    }
-                }],
-                "filter": filters
-            }
-        }
-    }
-
-    res = client.search(index=INDEX_NAME, body=body)
-    return res["hits"]["hits"]
+def lexical_search(query, start_date=None, end_date=None, size=10):
+    res = client.search(index=INDEX_NAME, body=_lexical_body(query, start_date, end_date, size))
+    return fetch_display_fields(res["hits"]["hits"])
 
 
 # -------------------------
 # Semantic Search
 # -------------------------
+@lru_cache(maxsize=4096)
+def _encode_query(query):
+    # Same model/backend the documents were indexed with, cached as the JSON
+    # array text the knn body embeds (immutable, and serialized only once)
+    return orjson.dumps(embed(query), option=orjson.OPT_SERIALIZE_NUMPY).decode()
+
+def _query_key(query):
+    # MiniLM's tokenizer is uncased and splits on whitespace, so "Reagan " and
+    # "reagan" embed identically and can share one cache slot
+    return " ".join(query.lower().split())
+
+def _semantic_body(query, size=10, knn_filter=None):
+    vec = _encode_query(_query_key(query))
+    if knn_filter:
+        return _SEM_FILTERED_TEMPLATE % (size, _SOURCE_JSON, vec, size, orjson.dumps(knn_filter).decode())
+    return _SEM_TEMPLATE % (size, _SOURCE_JSON, vec, size)
+
 def semantic_search(query, size=10):
-    vec = model.encode(query).tolist()
+    return fetch_display_fields(batched_search(_query_key(query), lambda: [_semantic_body(query, size)])[0])
 
-    body = {
-        "size": size,
-        "query": {
-            "knn": {
-                "content_vector": {
-                    "vector": vec,
-                    "k": size
-                }
-            }
-        }
-    }
 
-    res = client.search(index=INDEX_NAME, body=body)
-    return res["hits"]["hits"]
+# -------------------------
+# Display Fields
+# -------------------------
+def fetch_display_fields(hits):
+    # One mget for the returned hits, merged into the _source they already carry
+    if not hits:
+        return hits
+    res = client.mget(
+        index=INDEX_NAME,
+        body={"ids": [hit["_id"] for hit in hits]},
+        _source_includes=DISPLAY_FIELDS
+    )
+    for hit, doc in zip(hits, res["docs"]):
+        hit["_source"].update(doc.get("_source") or {})
+    return hits
+
+
+# -------------------------
+# Multi Search
+# -------------------------
+def _msearch_responses(bodies):
+    # Several searches in one round trip; OpenSearch runs them in parallel
+    lines = []
+    for body in bodies:
+        lines.append(_MSEARCH_HEADER)
+        lines.append(body)
+    return client.msearch(body=lines)["responses"]
+
+def _response_hits(response):
+    if "error" in response:
+        raise RuntimeError(f"Search failed: {response['error']}")
+    return response["hits"]["hits"]
+
+def multi_search(bodies):
+    # Returns one hit list per body, in order
+    return [_response_hits(response) for response in _msearch_responses(bodies)]
+
+
+# -------------------------
+# Request Batching (gevent workers)
+# -------------------------
+_search_queue = None
+
+def _batching_enabled():
+    # Only where gevent patched the I/O (gunicorn_conf.py workers): the dev server's
+    # threads and plain scripts can't wait on a greenlet from another thread
+    return monkey is not None and monkey.is_module_patched("socket")
+
+def _search_batcher():
+    # Collects the requests that arrive within SEARCH_BATCH_WINDOW and hands each
+    # batch to its own greenlet, so batches overlap instead of queueing behind
+    # a slow msearch (one pooled connection each)
+    while True:
+        batch = [_search_queue.get()]
+        gevent_sleep(SEARCH_BATCH_WINDOW)
+        while len(batch) < SEARCH_BATCH_MAX:
+            try:
+                batch.append(_search_queue.get_nowait())
+            except Empty:
+                break
+        spawn(_dispatch, batch)
+
+def _dispatch(batch):
+    # Encodes all queries of the batch in one embed_batch() call and sends all
+    # their bodies as one msearch, then answers each caller
+    try:
+        # Fills the embedding cache, so the knn bodies built below don't encode again
+        embed_batch(list(dict.fromkeys(query_key for query_key, _, _ in batch)))
+    except Exception as e:
+        print(f"Batched query encoding failed: {e}")  # Bodies encode one by one instead
+
+    pending = []
+    for _, build_bodies, result in batch:
+        try:
+            pending.append((result, build_bodies()))
+        except Exception as e:
+            result.set_exception(e)
+    if not pending:
+        return
+
+    try:
+        responses = _msearch_responses([body for _, bodies in pending for body in bodies])
+    except Exception as e:
+        for result, _ in pending:
+            result.set_exception(e)
+        return
+
+    pos = 0
+    for result, bodies in pending:
+        try:
+            result.set([_response_hits(response) for response in responses[pos:pos + len(bodies)]])
+        except Exception as e:
+            result.set_exception(e)
+        pos += len(bodies)
+
+def batched_search(query_key, build_bodies):
+    # Runs the bodies build_bodies() returns and gives back one hit list per body.
+    # In gevent workers concurrent requests share one encoder pass and one msearch;
+    # elsewhere it's a plain multi_search
+    global _search_queue
+    if not _batching_enabled():
+        return multi_search(build_bodies())
+    if _search_queue is None:
+        # Started lazily so each gunicorn worker gets its own, after the fork
+        _search_queue = Queue()
+        spawn(_search_batcher)
+    result = AsyncResult()
+    _search_queue.put((query_key, build_bodies, result))
+    return result.get()
 
 
 # -------------------------
 # Hybrid Search
 # -------------------------
+def _parse_date(date_str):
+    try:
+        return np.datetime64(date_str[:19], "s")
+    except (TypeError, ValueError):
+        return np.datetime64("NaT", "s")
+
+def parse_dates(date_strs):
+    # Indexed dates are naive ISO strings; their "YYYY-MM-DDTHH:MM:SS" prefixes go
+    # through numpy's C parser in one call (fractions/"Z" sliced off). NaT where
+    # missing; element-wise fallback only if some value doesn't parse
+    prefixes = [s[:19] if isinstance(s, str) and s else "NaT" for s in date_strs]
+    try:
+        return np.array(prefixes, dtype="datetime64[s]")
+    except ValueError:
+        return np.array([_parse_date(s) for s in prefixes], dtype="datetime64[s]")
+
+# Lucene's "_english_" list, the one the content analyzer uses. Stopwords in a
+# query would otherwise earn title/content boosts for matching "the", "of", ...
+ENGLISH_STOPWORDS = frozenset(
+    "a an and are as at be but by for if in into is it no not of on or such "
+    "that the their then there these they this to was will with".split()
+)
+
+def top_k(scores, k):
+    # Indices of the k highest scores, best first, exactly as a stable descending
+    # sort would pick them: everything above the k-th score, then the lowest-index
+    # candidates tied with it. O(n) partition, only the k winners are sorted
+    if k >= len(scores):
+        idx = np.arange(len(scores))
+    elif k <= 0:
+        return np.arange(0)
+    else:
+        kth = np.partition(scores, len(scores) - k)[len(scores) - k]
+        above = np.flatnonzero(scores > kth)
+        tied = np.flatnonzero(scores == kth)[:k - len(above)]
+        idx = np.concatenate([above, tied])
+    return idx[np.lexsort((idx, -scores[idx]))]
+
+# Lowercased place names/aliases and Reuters codes -> code
+PLACE_CODES = {name.lower(): code for name, code in GAZETTEER.items()}
+PLACE_CODES.update({code: code for code in PLACES_TO_LATLON})
+
+@lru_cache(maxsize=8192)
+def _geocode_mem(name):
+    # Georeference lookups for the request path. Known countries come from the
+    # static table; anything else goes through geocode_cached once per process
+    # (misses are memoized as None too)
+    code = PLACE_CODES.get(name.lower())
+    if code:
+        return PLACES_TO_LATLON[code]
+    return geocode_cached(name)
+
+EARTH_RADIUS_KM = 6371.0
+
+def haversine_km(lat1, lon1, lat2, lon2):
+    # Great-circle distance, element-wise over NumPy arrays. Within ~0.5% of
+    # geopy's geodesic, which is far below what the 10**(-km/10000) decay notices
+    lat1, lon1, lat2, lon2 = map(np.radians, (lat1, lon1, lat2, lon2))
+    a = np.sin((lat2 - lat1) / 2) ** 2 + np.cos(lat1) * np.cos(lat2) * np.sin((lon2 - lon1) / 2) ** 2
+    return 2 * EARTH_RADIUS_KM * np.arcsin(np.sqrt(np.clip(a, 0.0, 1.0)))
+
 def smart_hybrid_search(query_tuple,  # Tuple: (query_text, start_date, end_date, georeference)
  size: int = 10):
    
@@ -101,12 +288,12 @@ def smart_hybrid_search(query_tuple,  # Tuple: (query_text, start_date, end_date
     if end is None and start:
         end = datetime(start.year, 12, 31)
 
-    # Build date range filter
+    # Build date range filter (whole days: a date-only "lte" covers the entire end day)
     date_range = {}
     if start:
         date_range["gte"] = start.date().isoformat()
     if end:
-        date_range["lte"] = (end.date() + timedelta(days=1) - timedelta(seconds=1)).isoformat()
+        date_range["lte"] = end.date().isoformat()
     range_filter = {"range": {"date": date_range}} if date_range else None
 
     # Resolve georeference to coordinates
@@ -119,7 +306,7 @@ def smart_hybrid_search(query_tuple,  # Tuple: (query_text, start_date, end_date
             except:
                 pass
         if lat is None:
-            loc = geocode_cached(g)
+            loc = _geocode_mem(g)
             if loc:
                 lat, lon = loc["lat"], loc["lon"]
             elif "usa" in g.lower():
@@ -127,119 +314,96 @@ def smart_hybrid_search(query_tuple,  # Tuple: (query_text, start_date, end_date
 
     query_point = (lat, lon) if lat is not None and lon is not None else None
 
-    # 1. Lexical search using reusable function
-    lex_hits = lexical_search(
-        query=query_text,
-        start_date=start_date_input,
-        end_date=end_date_input,
-        size=size * 5
-    )
-
-    # 2. Semantic search using reusable function
-    sem_hits = semantic_search(query=query_text, size=size * 10)
-
-    # 3. Combine candidates
-    candidates = {}
+    # 1./2. Lexical and semantic search in one msearch round trip, shared with
+    # other requests arriving at the same time (see batched_search)
+    lex_body = _lexical_body(query_text, start_date_input, end_date_input, size=size * 5)
+    lex_hits, sem_hits = batched_search(_query_key(query_text), lambda: [
+        lex_body,
+        # The date range is applied inside the knn search, so all k neighbours are in
+        # range instead of being cut down afterwards (undated documents never match)
+        _semantic_body(query_text, size=size * 10, knn_filter=range_filter)
+    ])
+
+    # 3. Combine candidates as parallel lists indexed by candidate position
+    # (a hit found by both searches keeps its lexical hit and sums both scores)
+    position = {}  # doc id -> candidate index
+    hits = []
+    scores = []
     for hit in lex_hits:
-        doc_id = hit["_id"]
-        candidates[doc_id] = {
-            "hit": hit,
-            "source": hit["_source"],
-            "score": hit["_score"],
-            "lexical_score": hit["_score"],
-            "semantic_score": 0.0
-        }
+        position[hit["_id"]] = len(hits)
+        hits.append(hit)
+        scores.append(hit["_score"])
 
     for hit in sem_hits:
-        source = hit["_source"]
-        date_str = source.get("date")
-        # Apply date filter to semantic results
-        if date_range and date_str:
-            try:
-                doc_date = datetime.fromisoformat(date_str.replace("Z", "")).date()
-                if start and doc_date < start.date():
-                    continue
-                if end and doc_date > end.date():
-                    continue
-            except:
-                continue
-        elif date_range and not date_str:
-            continue
-
-        doc_id = hit["_id"]
-        if doc_id in candidates:
-            candidates[doc_id]["semantic_score"] = hit["_score"]
-            candidates[doc_id]["score"] += hit["_score"]
+        i = position.get(hit["_id"])
+        if i is None:
+            position[hit["_id"]] = len(hits)
+            hits.append(hit)
+            scores.append(hit["_score"])
         else:
-            candidates[doc_id] = {
-                "hit": hit,
-                "source": source,
-                "score": hit["_score"],
-                "lexical_score": 0.0,
-                "semantic_score": hit["_score"]
-            }
+            scores[i] += hit["_score"]
 
-    # 4. Re-ranking
+    # 4. Re-ranking: one boost array per signal, multiplied together at the end
     now = datetime(1987, 12, 31)
-    query_words = set(query_text.lower().split())
-
-    ranked = []
-    for info in candidates.values():
-        source = info["source"]
-        final_score = info["score"]
-
-        # Title boost
-        title_words = set(source.get("title", "").lower().split())
-        matches = len(query_words.intersection(title_words))
-        if matches > 0:
-            final_score *= (1 + matches * 2.5)
-
-        # Recency boost
-        date_str = source.get("date")
-        if date_str:
-            try:
-                doc_date = datetime.fromisoformat(date_str.replace("Z", ""))
-                months_old = max(0, (now - doc_date).days // 30)
-                final_score *= max(0.5, 1 - months_old * 0.02)
-            except:
-                pass
+    query_words = frozenset(query_text.lower().split()) - ENGLISH_STOPWORDS
+
+    sources = [hit["_source"] for hit in hits]
+    base = np.array(scores, dtype=np.float64)
+
+    query_hashes = {token_hash(w) for w in query_words}
+    query_bits = token_bits(query_words)
+
+    # Token lists precomputed at index time (candidates carry no title/content text)
+    def title_matches(source):
+        bits = source.get("title_bits")
+        if bits is not None and not bits & query_bits:
+            return 0  # No shared bit -> no shared word, skip the exact count
+        return len(query_words.intersection(source.get("title_tokens", ())))
+
+    def content_matches(source):
+        return len(query_hashes.intersection(source.get("content_token_hashes", ())))
 
-        # Geo proximity boost
-        if query_point:
-            gp = source.get("geopoint", {})
-            if gp.get("lat") and gp.get("lon"):
-                try:
-                    dist = geodesic(query_point, (gp["lat"], gp["lon"])).km
-                    final_score *= max(0.1, 10 ** (-dist / 10000))
-                except:
-                    pass
+    # Title boost (no matches -> factor 1)
+    title_boost = 1 + np.array([title_matches(source) for source in sources], dtype=np.float64) * 2.5
 
-        # Content boost (with cap)
-        content_words = set(source.get("content", "").lower().split())
-        content_matches = len(query_words.intersection(content_words))
-        final_score *= min(3.0, 1 + content_matches * 0.7)  # Cap at 3x boost
+    # Recency boost. Missing or unparseable dates (NaT -> NaN) get no adjustment
+    days_old = np.floor((np.datetime64(now) - parse_dates([source.get("date") for source in sources])) / np.timedelta64(1, "D"))
+    months_old = np.maximum(0, days_old // 30)
+    recency_boost = np.where(np.isnan(months_old), 1.0, np.maximum(0.5, 1 - months_old * 0.02))
 
-        ranked.append((info["hit"], final_score))
+    # Geo proximity boost (documents without a real geopoint, i.e. 0/missing, get none)
+    geo_boost = np.ones(len(hits))
+    if query_point:
+        geopoints = [source.get("geopoint") or {} for source in sources]
+        lats = np.array([gp.get("lat") or 0.0 for gp in geopoints], dtype=np.float64)
+        lons = np.array([gp.get("lon") or 0.0 for gp in geopoints], dtype=np.float64)
+        dist = haversine_km(query_point[0], query_point[1], lats, lons)
+        geo_boost = np.where((lats != 0) & (lons != 0), np.maximum(0.1, 10 ** (-dist / 10000)), 1.0)
 
-    ranked.sort(key=lambda x: x[1], reverse=True)
+    # Content boost (with cap)
+    content_counts = np.array([content_matches(source) for source in sources], dtype=np.float64)
+    content_boost = np.minimum(3.0, 1 + content_counts * 0.7)  # Cap at 3x boost
+
+    final_scores = base * title_boost * recency_boost * geo_boost * content_boost
+    order = top_k(final_scores, size)
 
     # === SCALE SCORES TO 0–100 ===
-    if ranked:
-        scores = [score for _, score in ranked]
-        min_score = min(scores)
-        max_score = max(scores)
+    if hits:
+        min_score = final_scores.min()
+        max_score = final_scores.max()
         score_range = max_score - min_score if max_score > min_score else 1
 
         top_hits = []
-        for hit, score in ranked[:size]:
-            normalized = (score - min_score) / score_range
+        for i in order:
+            hit = hits[i]
+            normalized = (final_scores[i] - min_score) / score_range
             score_100 = normalized * 100
-            hit["_score"] = round(score_100, 2)
+            hit["_score"] = round(float(score_100), 2)
             top_hits.append(hit)
     else:
         top_hits = []
 
-    return {"hits": {"hits": top_hits}}
+    return {"hits": {"hits": fetch_display_fields(top_hits)}}
 # -------------------------
 # Autocomplete
 # -------------------------
@@ -250,20 +414,28 @@ def autocomplete_titles(prefix, size=10):
         return []
     body = {
         "_source": ["title"],
-        "size": size,
-        "query": {
-            "bool": {
-                "should": [
-                    {"match_phrase_prefix": {"title": {"query": prefix}}},
-                    {"match": {"title": {"query": prefix, "fuzziness": 1, "prefix_length": 2}}}
-                ]
+        "suggest": {
+            "titles": {
+                "prefix": prefix,
+                "completion": {
+                    "field": "title_suggest",
+                    "size": size * 2,  # Room for several suffixes of one title
+                    "skip_duplicates": True,
+                    "fuzzy": {"fuzziness": 1, "prefix_length": 2}
+                }
             }
         }
     }
-    res = client.search(index=INDEX_NAME, body=body)
+    try:
+        res = client.search(index=INDEX_NAME, body=body)
+        hits = res["suggest"]["titles"][0]["options"]
+    except RequestError:
+        # Index built before title_suggest existed
+        hits = _autocomplete_query(prefix, size)
+
     seen = set()
     titles = []
-    for hit in res["hits"]["hits"]:
+    for hit in hits:
         t = hit["_source"].get("title","").strip()
         if t and t not in seen:
             titles.append(t)
@@ -272,6 +444,21 @@ def autocomplete_titles(prefix, size=10):
             break
     return titles    
 
+def _autocomplete_query(prefix, size):
+    body = {
+        "_source": ["title"],
+        "size": size,
+        "query": {
+            "bool": {
+                "should": [
+                    {"match_phrase_prefix": {"title": {"query": prefix}}},
+                    {"match": {"title": {"query": prefix, "fuzziness": 1, "prefix_length": 2}}}
+                ]
+            }
+        }
+    }
+    res = client.search(index=INDEX_NAME, body=body)
+    return res["hits"]["hits"]
 
 
 